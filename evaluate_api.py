@@ -1,9 +1,11 @@
 import argparse
-import json
+import asyncio
+import functools
 import time
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
+import aiohttp
+import orjson
 
 
 DEFAULT_TESTS: List[str] = [
@@ -16,8 +18,15 @@ DEFAULT_TESTS: List[str] = [
 ]
 
 
+# Server-side limit on instructions per /generate_batch request (MAX_BATCH_INSTRUCTIONS in the notebook).
+MAX_BATCH_INSTRUCTIONS = 16
+
+
+@functools.lru_cache(maxsize=16)
 def _normalize_base(url: str) -> str:
     url = (url or "").strip().rstrip("/")
+    if url.endswith("/generate_batch"):
+        url = url[: -len("/generate_batch")]
     if url.endswith("/generate"):
         url = url[: -len("/generate")]
     if url.endswith("/health"):
@@ -25,67 +34,65 @@ def _normalize_base(url: str) -> str:
     return url
 
 
-def _get_json(url: str, timeout_s: int = 10) -> Dict[str, Any]:
-    resp = requests.get(url, timeout=timeout_s)
-    resp.raise_for_status()
-    return resp.json()
+# ngrok answers with these while the tunnel hiccups; the health probe retries them.
+_RETRY_STATUSES = (502, 503, 504)
+
 
+async def _get_health(
+    sess: aiohttp.ClientSession,
+    health_url: str,
+    timeout_s: int = 10,
+    retries: int = 2,
+    backoff_s: float = 0.2,
+) -> Dict[str, Any]:
+    timeout = aiohttp.ClientTimeout(total=timeout_s)
+    for attempt in range(retries):
+        try:
+            async with sess.get(health_url, timeout=timeout) as resp:
+                if resp.status not in _RETRY_STATUSES:
+                    resp.raise_for_status()
+                    return orjson.loads(await resp.read())
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            pass
+        await asyncio.sleep(backoff_s * 2**attempt)
 
-def _post_json(url: str, payload: Dict[str, Any], timeout_s: int = 180) -> Dict[str, Any]:
-    resp = requests.post(url, json=payload, timeout=timeout_s)
-    resp.raise_for_status()
-    return resp.json()
+    # Final attempt: whatever happens now is reported to the caller.
+    async with sess.get(health_url, timeout=timeout) as resp:
+        resp.raise_for_status()
+        return orjson.loads(await resp.read())
 
 
-def _is_non_empty_if(policy: Any) -> bool:
-    if not isinstance(policy, dict):
-        return False
+def _validate(policy: Dict[str, Any]) -> List[str]:
+    # Single pass over the policy: each sub-dict is looked up and type-checked once.
     props = policy.get("properties")
     if not isinstance(props, dict):
-        return False
+        # Every other check depends on properties, so report just the root cause.
+        return ["missing_properties"]
+
+    issues: List[str] = []
     pr = props.get("policyRule")
     if not isinstance(pr, dict):
-        return False
+        pr = {}
+
     if_block = pr.get("if")
-    if not isinstance(if_block, dict):
-        return False
-    if if_block == {}:
-        return False
-    all_of = if_block.get("allOf")
-    any_of = if_block.get("anyOf")
-    if isinstance(all_of, list) and len(all_of) == 0:
-        return False
-    if isinstance(any_of, list) and len(any_of) == 0:
-        return False
-    return True
-
-
-def _has_effect_parameter(policy: Any) -> bool:
-    if not isinstance(policy, dict):
-        return False
-    props = policy.get("properties")
-    if not isinstance(props, dict):
-        return False
-    params = props.get("parameters")
-    if not isinstance(params, dict):
-        return False
-    eff = params.get("effect")
-    return isinstance(eff, dict) and eff.get("type") == "String"
+    if not isinstance(if_block, dict) or if_block == {}:
+        issues.append("empty_if")
+    else:
+        all_of = if_block.get("allOf")
+        any_of = if_block.get("anyOf")
+        if (isinstance(all_of, list) and len(all_of) == 0) or (isinstance(any_of, list) and len(any_of) == 0):
+            issues.append("empty_if")
 
+    params = props.get("parameters")
+    eff = params.get("effect") if isinstance(params, dict) else None
+    if not (isinstance(eff, dict) and eff.get("type") == "String"):
+        issues.append("missing_effect_parameter")
 
-def _then_effect_parameterized(policy: Any) -> bool:
-    if not isinstance(policy, dict):
-        return False
-    props = policy.get("properties")
-    if not isinstance(props, dict):
-        return False
-    pr = props.get("policyRule")
-    if not isinstance(pr, dict):
-        return False
     then = pr.get("then")
-    if not isinstance(then, dict):
-        return False
-    return then.get("effect") == "[parameters('effect')]"
+    if not (isinstance(then, dict) and then.get("effect") == "[parameters('effect')]"):
+        issues.append("then_effect_not_parameterized")
+
+    return issues
 
 
 def score_one(result: Dict[str, Any]) -> Tuple[bool, List[str]]:
@@ -99,73 +106,168 @@ def score_one(result: Dict[str, Any]) -> Tuple[bool, List[str]]:
         issues.append("missing_fixed_policy")
         return False, issues
 
-    if "properties" not in fixed_policy:
-        issues.append("missing_properties")
-    if not _is_non_empty_if(fixed_policy):
-        issues.append("empty_if")
-    if not _has_effect_parameter(fixed_policy):
-        issues.append("missing_effect_parameter")
-    if not _then_effect_parameterized(fixed_policy):
-        issues.append("then_effect_not_parameterized")
+    issues.extend(_validate(fixed_policy))
 
     ok = len(issues) == 0
     return ok, issues
 
 
+def _record(instruction: str, result: Any, elapsed_s: float) -> Dict[str, Any]:
+    # A 200 body that isn't a JSON object (list, string, ...) scores as missing_fixed_policy.
+    if not isinstance(result, dict):
+        result = {}
+    passed, issues = score_one(result)
+    return {
+        "instruction": instruction,
+        "passed": passed,
+        "issues": issues,
+        "retry": result.get("retry"),
+        "meta": result.get("meta"),
+        "elapsed_s": elapsed_s,
+    }
+
+
+async def _run_one(
+    sess: aiohttp.ClientSession,
+    sem: asyncio.Semaphore,
+    gen_url: str,
+    instruction: str,
+    timeout_s: int,
+) -> Dict[str, Any]:
+    async with sem:
+        started = time.time()
+        try:
+            async with sess.post(
+                gen_url,
+                json={"instruction": instruction},
+                timeout=aiohttp.ClientTimeout(total=timeout_s),
+            ) as resp:
+                resp.raise_for_status()
+                result = orjson.loads(await resp.read())
+        except Exception as e:
+            # Timeouts stringify to "", so fall back to the exception type.
+            return {"instruction": instruction, "error": str(e) or type(e).__name__}
+
+    return _record(instruction, result, round(time.time() - started, 2))
+
+
+async def _run_batch(
+    sess: aiohttp.ClientSession,
+    batch_url: str,
+    tests: List[str],
+    timeout_s: int,
+) -> Optional[List[Dict[str, Any]]]:
+    """POST one chunk of tests to /generate_batch; None if the endpoint answered 404/405."""
+    started = time.time()
+    try:
+        async with sess.post(
+            batch_url,
+            json={"instructions": tests},
+            # Retries run one by one on the server, so allow the per-request budget for each test.
+            timeout=aiohttp.ClientTimeout(total=timeout_s * max(1, len(tests))),
+        ) as resp:
+            if resp.status in (404, 405):
+                return None
+            resp.raise_for_status()
+            results = orjson.loads(await resp.read())
+        if not isinstance(results, list) or len(results) != len(tests):
+            raise ValueError(f"unexpected /generate_batch response: {str(results)[:200]}")
+    except Exception as e:
+        err = str(e) or type(e).__name__
+        return [{"instruction": t, "error": err} for t in tests]
+
+    elapsed = round(time.time() - started, 2)
+    return [_record(t, r, elapsed) for t, r in zip(tests, results)]
+
+
+async def _run_all(
+    base: str,
+    tests: List[str],
+    out_path: str,
+    timeout_s: int,
+    concurrency: int,
+    use_batch: bool = True,
+) -> Tuple[int, int]:
+    ok_count = 0
+    total = 0
+    sem = asyncio.Semaphore(max(1, concurrency))
+    # Keep the resolved address for the whole run so fallback per-test connections skip DNS.
+    connector = aiohttp.TCPConnector(limit=max(1, concurrency), ttl_dns_cache=300)
+
+    def emit(rec: Dict[str, Any]) -> None:
+        nonlocal ok_count, total
+        total += 1
+        f.write(orjson.dumps(rec) + b"\n")
+        f.flush()
+
+        t = rec["instruction"]
+        if "error" in rec:
+            print(f"[{total}] FAIL request: {t} -> {rec['error']}")
+        elif rec["passed"]:
+            ok_count += 1
+            print(f"[{total}] PASS ({rec['elapsed_s']}s) {t}")
+        else:
+            print(f"[{total}] FAIL ({rec['elapsed_s']}s) {t} -> {rec['issues']}")
+
+    async with aiohttp.ClientSession(connector=connector) as sess:
+        # Probing /health on the same session resolves DNS and completes the TLS handshake up front;
+        # the pooled keep-alive connection is then reused by the first generate POST.
+        print("Checking health...")
+        try:
+            health = await _get_health(sess, f"{base}/health")
+            print("Health:", orjson.dumps(health, option=orjson.OPT_INDENT_2).decode())
+            if not health.get("model_loaded"):
+                raise SystemExit("Model not loaded on server. Run the notebook model-load cell, then restart the API.")
+        except Exception as e:
+            raise SystemExit(f"Health check failed: {e}")
+
+        with open(out_path, "wb") as f:
+            # One round trip per MAX_BATCH_INSTRUCTIONS tests when the server supports it.
+            batched = False
+            if use_batch:
+                for i in range(0, len(tests), MAX_BATCH_INSTRUCTIONS):
+                    chunk = tests[i : i + MAX_BATCH_INSTRUCTIONS]
+                    recs = await _run_batch(sess, f"{base}/generate_batch", chunk, timeout_s)
+                    if recs is None:
+                        if not batched:
+                            # Server has no /generate_batch; fall back to per-test /generate below.
+                            break
+                        # The endpoint worked for earlier chunks, so a 404 now means the tunnel went away
+                        # (ngrok ERR_NGROK_3200); record these tests as failed rather than dropping them.
+                        recs = [
+                            {"instruction": t, "error": "/generate_batch returned 404/405 mid-run"} for t in chunk
+                        ]
+                    batched = True
+                    for rec in recs:
+                        emit(rec)
+            if not batched:
+                tasks = [_run_one(sess, sem, f"{base}/generate", t, timeout_s) for t in tests]
+                # Write records in completion order so fast cases stream out first.
+                for fut in asyncio.as_completed(tasks):
+                    emit(await fut)
+
+    return ok_count, total
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--api", required=True, help="Base API URL (ngrok), e.g. https://xxxx.ngrok-free.app")
     parser.add_argument("--out", default="eval_results.jsonl", help="Where to write JSONL results")
     parser.add_argument("--timeout", type=int, default=180)
     parser.add_argument("--tests", nargs="*", default=DEFAULT_TESTS)
+    parser.add_argument("--concurrency", type=int, default=8, help="Max in-flight /generate requests")
+    parser.add_argument(
+        "--no-batch",
+        action="store_true",
+        help="Send one /generate request per test instead of a single /generate_batch call",
+    )
     args = parser.parse_args()
 
     base = _normalize_base(args.api)
-    health_url = f"{base}/health"
-    gen_url = f"{base}/generate"
-
     print("API:", base)
-    print("Checking health...")
-    try:
-        health = _get_json(health_url)
-        print("Health:", json.dumps(health, indent=2))
-        if not health.get("model_loaded"):
-            raise SystemExit("Model not loaded on server. Run the notebook model-load cell, then restart the API.")
-    except Exception as e:
-        raise SystemExit(f"Health check failed: {e}")
-
-    ok_count = 0
-    total = 0
-
-    with open(args.out, "w", encoding="utf-8") as f:
-        for t in args.tests:
-            total += 1
-            started = time.time()
-            try:
-                result = _post_json(gen_url, {"instruction": t}, timeout_s=args.timeout)
-            except Exception as e:
-                rec = {"instruction": t, "error": str(e)}
-                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-                print(f"[{total}] FAIL request: {t} -> {e}")
-                continue
-
-            passed, issues = score_one(result)
-            elapsed = round(time.time() - started, 2)
-            rec = {
-                "instruction": t,
-                "passed": passed,
-                "issues": issues,
-                "retry": result.get("retry"),
-                "meta": result.get("meta"),
-                "elapsed_s": elapsed,
-            }
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-
-            if passed:
-                ok_count += 1
-                print(f"[{total}] PASS ({elapsed}s) {t}")
-            else:
-                print(f"[{total}] FAIL ({elapsed}s) {t} -> {issues}")
+    ok_count, total = asyncio.run(
+        _run_all(base, args.tests, args.out, args.timeout, args.concurrency, use_batch=not args.no_batch)
+    )
 
     print(f"\nSummary: {ok_count}/{total} passed")
     print("Wrote:", args.out)
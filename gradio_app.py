@@ -1,13 +1,43 @@
+import functools
 import os
-import json
+import time
 from typing import Any, Dict, Optional, Tuple
 
 import gradio as gr
-import requests
+import httpx
+import orjson
 
 
-def _post_generate(api_base_url: str, instruction: str, timeout_s: int = 180) -> Tuple[str, str]:
-    api_base_url = (api_base_url or "").strip()
+def _make_client() -> httpx.AsyncClient:
+    # Shared across submits: one pooled HTTP/2 connection multiplexes /health and /generate,
+    # and awaiting it frees Gradio's event loop while the Colab model is generating.
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=8, max_keepalive_connections=8),
+    )
+    return httpx.AsyncClient(transport=transport, timeout=httpx.Timeout(180.0))
+
+
+_ASYNC_CLIENT = _make_client()
+
+# api_base_url -> (checked_at, ok). A healthy result is trusted for _HEALTH_TTL_S seconds.
+_HEALTH_TTL_S = 60.0
+_HEALTH_CACHE: Dict[str, Tuple[float, bool]] = {}
+
+
+@functools.lru_cache(maxsize=16)
+def _api_urls(api_base_url: str) -> Tuple[str, str, str]:
+    """Return (base, health_url, generate_url); cached since the UI resubmits the same URL."""
+    # Be forgiving if the user pastes the full endpoint URL.
+    base = api_base_url.strip().rstrip("/")
+    if base.endswith("/generate"):
+        base = base[: -len("/generate")]
+    return base, f"{base}/health", f"{base}/generate"
+
+
+async def _post_generate(api_base_url: str, instruction: str, timeout_s: int = 180) -> Tuple[str, str]:
+    api_base_url, health_url, url = _api_urls(api_base_url or "")
     instruction = (instruction or "").strip()
 
     if not api_base_url:
@@ -15,30 +45,30 @@ def _post_generate(api_base_url: str, instruction: str, timeout_s: int = 180) ->
     if not instruction:
         return "", "ERROR: Instruction is empty"
 
-    # Be forgiving if the user pastes the full endpoint URL.
-    api_base_url = api_base_url.rstrip("/")
-    if api_base_url.endswith("/generate"):
-        api_base_url = api_base_url[: -len("/generate")]
+    # Optional health check (helps catch "model not loaded" early). Skipped while a recent probe was healthy.
+    checked_at, healthy = _HEALTH_CACHE.get(api_base_url, (0.0, True))
+    if not healthy or time.time() - checked_at >= _HEALTH_TTL_S:
+        try:
+            h = await _ASYNC_CLIENT.get(health_url, timeout=8)
+            if h.status_code == 200:
+                health = orjson.loads(h.content)
+                if isinstance(health, dict) and health.get("model_loaded") is False:
+                    _HEALTH_CACHE[api_base_url] = (time.time(), False)
+                    return "", "ERROR: Colab API is up but model is not loaded.\nRun the notebook model-load cell, then restart the API cell."
+            _HEALTH_CACHE[api_base_url] = (time.time(), True)
+        except Exception:
+            # Ignore health errors; server may not expose /health.
+            pass
 
-    # Optional health check (helps catch "model not loaded" early).
-    health_url = f"{api_base_url}/health"
-    try:
-        h = requests.get(health_url, timeout=8)
-        if h.status_code == 200:
-            health = h.json()
-            if isinstance(health, dict) and health.get("model_loaded") is False:
-                return "", "ERROR: Colab API is up but model is not loaded.\nRun the notebook model-load cell, then restart the API cell."
-    except Exception:
-        # Ignore health errors; server may not expose /health.
-        pass
-
-    url = f"{api_base_url}/generate"
     try:
-        resp = requests.post(url, json={"instruction": instruction}, timeout=timeout_s)
-    except requests.RequestException as e:
+        resp = await _ASYNC_CLIENT.post(url, json={"instruction": instruction}, timeout=timeout_s)
+    except (httpx.HTTPError, httpx.InvalidURL) as e:
+        _HEALTH_CACHE.pop(api_base_url, None)
         return "", f"ERROR: Request failed: {e}"
 
     if resp.status_code != 200:
+        # Re-probe /health on the next submit.
+        _HEALTH_CACHE.pop(api_base_url, None)
         content_type = resp.headers.get("content-type", "")
         body = resp.text or ""
         # ngrok offline pages are HTML and can be very noisy; detect and provide a helpful hint.
@@ -54,7 +84,7 @@ def _post_generate(api_base_url: str, instruction: str, timeout_s: int = 180) ->
         return "", f"ERROR: {resp.status_code} {body[:2000]}"
 
     try:
-        payload: Dict[str, Any] = resp.json()
+        payload: Dict[str, Any] = orjson.loads(resp.content)
     except Exception as e:
         return "", f"ERROR: Non-JSON response from server: {e}\n\nRaw:\n{resp.text[:2000]}"
 
@@ -67,7 +97,7 @@ def _post_generate(api_base_url: str, instruction: str, timeout_s: int = 180) ->
     meta = payload.get("meta")
     retry = payload.get("retry")
 
-    pretty_policy = json.dumps(fixed_policy, indent=2, ensure_ascii=False) if isinstance(fixed_policy, (dict, list)) else str(fixed_policy)
+    pretty_policy = orjson.dumps(fixed_policy, option=orjson.OPT_INDENT_2).decode() if isinstance(fixed_policy, (dict, list)) else str(fixed_policy)
 
     header_lines = []
     if retry is not None: